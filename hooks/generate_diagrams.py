@@ -1,7 +1,13 @@
 """MkDocs hook to regenerate typestate diagrams on pre-build.
 
 This hook runs before each mkdocs build (including during `mkdocs serve`)
-and regenerates SVG diagrams from the snippet files only if sources changed.
+and regenerates SVG diagrams for the snippet files whose sources changed.
+
+Source content hashes and the files generated from them are recorded in
+docs/assets/images/generated/.diagram-hashes.json by the generator script
+(whether run here or directly), so diagrams generated by an earlier
+`python3 scripts/generate_diagrams.py` aren't generated again. Snippets
+whose recorded files are missing are regenerated too.
 
 To force regeneration:
     FORCE_DIAGRAM_GEN=1 mkdocs serve
@@ -10,37 +16,176 @@ To disable completely:
     SKIP_DIAGRAM_GEN=1 mkdocs serve
 """
 
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import io
+import json
 import logging
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import ModuleType
 
 log = logging.getLogger("mkdocs.hooks.generate_diagrams")
 
+HASHES_FILE = ".diagram-hashes.json"
+GENERATOR_SCRIPT = Path(__file__).parent.parent / "scripts" / "generate_diagrams.py"
+
+# Content hashes keyed by path, with the (mtime_ns, size) they were computed at
+_hash_cache: dict[Path, tuple[tuple[int, int], str]] = {}
+
+# Snippet paths from the last directory scan, with the directory mtime_ns
+_snippet_listing: tuple[int, list[Path]] | None = None
+
+# Parsed HASHES_FILE, with the file mtime_ns it was read at
+_recorded: tuple[int, dict[str, dict]] | None = None
+
+# Shared across rebuilds; worker threads are only started on first use
+_stat_pool = ThreadPoolExecutor(max_workers=16)
+
+
+def _file_hash(path: Path, st: os.stat_result) -> str:
+    """Hash a file's contents, reusing the cached hash if its stat is unchanged.
+
+    Under `mkdocs serve` this runs on every rebuild; keying the cache on
+    (mtime, size) means unchanged files are stat'ed but never re-read.
+    """
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _hash_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.blake2b(path.read_bytes()).hexdigest()
+    _hash_cache[path] = (signature, digest)
+    return digest
+
+
+def _scan_snippets(snippets_dir: Path) -> dict[Path, os.stat_result]:
+    """Find snippet files and their stats.
+
+    The directory is only re-read when its mtime changes (a snippet was
+    added, removed or renamed); otherwise the previous listing is reused
+    and just the snippets themselves are stat'ed. Stats run on a thread
+    pool so their latency overlaps on network filesystems.
+    """
+    global _snippet_listing
+
+    dir_mtime = snippets_dir.stat().st_mtime_ns
+    if _snippet_listing is not None and _snippet_listing[0] == dir_mtime:
+        paths = _snippet_listing[1]
+        return dict(zip(paths, _stat_pool.map(Path.stat, paths)))
+
+    with os.scandir(snippets_dir) as entries:
+        snippets = [e for e in entries if e.name.endswith("_typestate.nim")]
+        stats = dict(zip(
+            (Path(entry.path) for entry in snippets),
+            _stat_pool.map(os.DirEntry.stat, snippets),
+        ))
+    _snippet_listing = (dir_mtime, list(stats))
+    return stats
+
+
+def _source_hashes(stats: dict[Path, os.stat_result]) -> dict[str, str]:
+    """Hash the contents of every snippet and the CLI (CLI changes affect output)."""
+    return {str(path): _file_hash(path, st) for path, st in stats.items()}
+
+
+def _recorded_hashes(hashes_path: Path) -> dict[str, dict] | None:
+    """Load the hashes and outputs recorded at the last build, or None if there are none.
+
+    The parsed file is kept in memory and only re-read when its mtime
+    changes, so an up-to-date rebuild costs one stat rather than a read
+    and JSON parse.
+    """
+    global _recorded
+
+    try:
+        mtime = hashes_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if _recorded is None or _recorded[0] != mtime:
+        try:
+            _recorded = (mtime, json.loads(hashes_path.read_text()))
+        except json.JSONDecodeError:
+            return None
+
+    return _recorded[1]
+
+
+def _needs_regeneration(
+    snippet_files: list[Path], cli_path: Path, hashes: dict[str, str], hashes_path: Path
+) -> list[Path]:
+    """Return the snippets whose hashes changed or outputs went missing.
+
+    Content hashes are used rather than mtimes so that checkouts and saves
+    that touch files without changing them don't trigger regeneration.
+    Every snippet is stale if the CLI changed.
+    """
+    recorded = _recorded_hashes(hashes_path)
+    if recorded is None:
+        return snippet_files
+
+    if recorded.get(str(cli_path)) != {"hash": hashes[str(cli_path)]}:
+        return snippet_files
 
-def _needs_regeneration(snippet_files: list[Path], output_dir: Path, cli_path: Path) -> bool:
-    """Check if any snippet is newer than its corresponding SVG output."""
+    stale = set()
+    outputs = []
     for snippet in snippet_files:
-        # Output filename is based on typestate name or file stem
-        stem = snippet.stem.replace("_typestate", "").lower()
-        svg_path = output_dir / f"{stem}.svg"
+        entry = recorded.get(str(snippet))
+        if (
+            not isinstance(entry, dict)
+            or entry.get("hash") != hashes[str(snippet)]
+            or "outputs" not in entry
+        ):
+            stale.add(snippet)
+        else:
+            outputs.extend((snippet, path) for path in entry["outputs"])
 
-        # If output doesn't exist, needs regeneration
-        if not svg_path.exists():
-            return True
+    # Diagrams deleted by hand are regenerated even if their sources didn't change
+    exists = _stat_pool.map(os.path.exists, [path for _, path in outputs])
+    stale.update(snippet for (snippet, _), found in zip(outputs, exists) if not found)
 
-        # If snippet is newer than output, needs regeneration
-        if snippet.stat().st_mtime > svg_path.stat().st_mtime:
-            return True
+    return [snippet for snippet in snippet_files if snippet in stale]
 
-    # Also check if CLI is newer than any output (CLI changes affect output)
-    if cli_path.exists():
-        cli_mtime = cli_path.stat().st_mtime
-        for svg in output_dir.glob("*.svg"):
-            if cli_mtime > svg.stat().st_mtime:
-                return True
 
-    return False
+@functools.cache
+def _load_generator() -> ModuleType:
+    """Import scripts/generate_diagrams.py so its main() can run in-process.
+
+    Loaded under its own name, since this hook module is also called
+    generate_diagrams.
+    """
+    spec = importlib.util.spec_from_file_location(
+        "typestates_diagram_generator", GENERATOR_SCRIPT
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@functools.cache
+def _graphviz_available() -> bool:
+    """Check for pygraphviz, falling back to probing the `dot` command.
+
+    Cached for the life of the process, so `mkdocs serve` probes once
+    rather than spawning `dot -V` on every rebuild.
+    """
+    if importlib.util.find_spec("pygraphviz") is not None:
+        return True
+
+    try:
+        subprocess.run(
+            ["dot", "-V"],
+            capture_output=True,
+            check=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+    return True
 
 
 def on_pre_build(config, **kwargs) -> None:
@@ -56,17 +201,21 @@ def on_pre_build(config, **kwargs) -> None:
     cli_path = Path("bin/typestates")
 
     # Check if we have snippets to process
-    if not snippets_dir.exists():
+    try:
+        snippet_stats = _scan_snippets(snippets_dir)
+    except FileNotFoundError:
         log.debug("No snippets directory found, skipping diagram generation")
         return
 
-    snippet_files = list(snippets_dir.glob("*_typestate.nim"))
+    snippet_files = list(snippet_stats)
     if not snippet_files:
         log.debug("No snippet files found, skipping diagram generation")
         return
 
     # Check if CLI exists
-    if not cli_path.exists():
+    try:
+        cli_stat = cli_path.stat()
+    except FileNotFoundError:
         log.warning(
             "typestates CLI not found at bin/typestates. "
             "Run 'nimble build' to enable diagram generation."
@@ -75,34 +224,38 @@ def on_pre_build(config, **kwargs) -> None:
 
     # Check if regeneration is needed (unless forced)
     force = os.environ.get("FORCE_DIAGRAM_GEN")
-    if not force and not _needs_regeneration(snippet_files, output_dir, cli_path):
+    hashes = _source_hashes({**snippet_stats, cli_path: cli_stat})
+    hashes_path = output_dir / HASHES_FILE
+    if force:
+        stale_files = snippet_files
+    else:
+        stale_files = _needs_regeneration(snippet_files, cli_path, hashes, hashes_path)
+    if not stale_files:
         log.debug("Diagrams are up-to-date, skipping generation")
         return
 
-    # Check if graphviz is available
-    try:
-        subprocess.run(
-            ["dot", "-V"],
-            capture_output=True,
-            check=True
-        )
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    # Check if graphviz is available (pygraphviz renders without spawning dot)
+    if not _graphviz_available():
         log.warning(
             "Graphviz 'dot' command not found. "
             "Install graphviz to enable diagram generation."
         )
         return
 
-    log.info(f"Generating diagrams from {len(snippet_files)} snippets...")
+    log.info(f"Generating diagrams from {len(stale_files)} snippets...")
 
-    # Run the generation script
-    result = subprocess.run(
-        ["python3", "scripts/generate_diagrams.py"],
-        capture_output=True,
-        text=True
-    )
+    # Run the generation script in-process on the changed snippets only
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            returncode = _load_generator().main(stale_files)
+    except Exception as e:
+        # A crashing generator shouldn't take down the whole build
+        log.error(f"Diagram generation failed: {e!r}\n{output.getvalue()}")
+        return
 
-    if result.returncode != 0:
-        log.error(f"Diagram generation failed: {result.stderr}")
+    if returncode != 0:
+        log.error(f"Diagram generation failed: {output.getvalue()}")
     else:
+        log.debug(output.getvalue())
         log.info("Diagrams generated successfully")
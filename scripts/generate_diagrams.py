@@ -4,100 +4,364 @@
 This script uses the typestates CLI to generate DOT output from snippet files,
 then converts them to SVG using Graphviz.
 
+Snippets are sent to a long-lived `typestates serve-dot` process, which
+streams back each snippet's DOT named after its typestate. If pygraphviz is
+installed the graphs are rendered in-process through libgvc; otherwise they
+are piped through one `dot` process per CPU in parallel, each starting as
+soon as its batch of graphs has arrived. The DOT text never round-trips
+through disk; .dot files are written alongside for reference.
+
 Usage:
-    python scripts/generate_diagrams.py
+    python scripts/generate_diagrams.py [snippet files...]
 
 Requires:
     - bin/typestates CLI built
-    - graphviz installed (dot command)
+    - graphviz installed (dot command), or pygraphviz (optional, faster)
 """
 
+import atexit
+import contextlib
+import hashlib
+import json
+import os
+import selectors
 import subprocess
 import sys
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import pygraphviz
+except ImportError:
+    pygraphviz = None
+
 SNIPPETS_DIR = Path("examples/snippets")
 OUTPUT_DIR = Path("docs/assets/images/generated")
+HASHES_FILE = OUTPUT_DIR / ".diagram-hashes.json"
+SVG_END = "</svg>\n"
+FRAME_START = b"===DOT==="
+FRAME_ERROR = b"===ERROR==="
+FRAME_END = b"===END===\n"
+CLI_PATH = Path("./bin/typestates")
+CLI_TIMEOUT = 30  # seconds to wait for each serve-dot reply
+
+# Long-lived `typestates serve-dot` process and the CLI mtime it started from
+_cli_server: subprocess.Popen | None = None
+_cli_server_mtime: int | None = None
 
 
-def extract_output_name(nim_file: Path) -> str:
-    """Extract output name from a .nim file.
+def write_if_changed(path: Path, content: str) -> bool:
+    """Atomically write content to path unless the file already holds it.
 
-    For single-typestate files, uses the typestate name.
-    For multi-typestate files (like multi_typestate.nim), uses the filename stem.
-    Handles generics like 'Container[T]' by extracting base name.
+    Leaving identical files untouched keeps their mtimes, so MkDocs and
+    browser caches don't treat regenerated-but-unchanged diagrams as new.
+    Changed files are written to a temporary file and moved into place,
+    so `mkdocs serve` never copies a half-written diagram.
+
+    Returns True if the file was written.
     """
-    content = nim_file.read_text()
-    typestate_names = []
-
-    for line in content.split("\n"):
-        line = line.strip()
-        if line.startswith("typestate "):
-            # Extract: "typestate Payment:" -> "Payment"
-            name = line.replace("typestate ", "").rstrip(":")
-            # Handle generics: "Container[T]" -> "Container"
-            if "[" in name:
-                name = name.split("[")[0]
-            typestate_names.append(name.strip())
-
-    if len(typestate_names) == 0:
-        # Fallback to filename without _typestate suffix
-        return nim_file.stem.replace("_typestate", "")
-    elif len(typestate_names) == 1:
-        # Single typestate - use its name
-        return typestate_names[0]
-    else:
-        # Multiple typestates - use filename stem (e.g., "multi" from "multi_typestate.nim")
-        return nim_file.stem.replace("_typestate", "")
+    try:
+        if path.read_text() == content:
+            return False
+    except FileNotFoundError:
+        pass
+
+    tmp_path = path.with_name(f"{path.name}.new")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def file_hash(path: Path) -> str:
+    """Hash a file's contents, as recorded in HASHES_FILE."""
+    return hashlib.blake2b(path.read_bytes()).hexdigest()
+
+
+def record_hashes(hashes: dict[Path, str], outputs: dict[Path, list[Path]]) -> None:
+    """Record freshly generated diagrams and their source hashes in HASHES_FILE.
+
+    Each snippet in `outputs` is recorded with its hash and the files
+    generated for it. The mkdocs hook compares these against the current
+    sources, and checks the files still exist, to skip snippets whose
+    diagrams are up-to-date. Entries for other snippets are kept unless
+    the CLI changed, since their diagrams may now differ.
+    """
+    try:
+        recorded = json.loads(HASHES_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        recorded = {}
+
+    cli_entry = {"hash": hashes[CLI_PATH]}
+    if recorded.get(str(CLI_PATH)) != cli_entry:
+        recorded = {}
+    recorded[str(CLI_PATH)] = cli_entry
+    for snippet, files in outputs.items():
+        recorded[str(snippet)] = {
+            "hash": hashes[snippet],
+            "outputs": [str(path) for path in files],
+        }
+    write_if_changed(HASHES_FILE, json.dumps(recorded, indent=2, sort_keys=True) + "\n")
+
+
+def cli_server() -> subprocess.Popen:
+    """Return the running `typestates serve-dot` process, starting it if needed.
+
+    The process is reused across calls so that repeated builds (e.g. the
+    mkdocs hook under `mkdocs serve`) start the CLI once. It is restarted
+    if it exited or if the CLI binary was rebuilt since it started.
+    """
+    global _cli_server, _cli_server_mtime
+
+    cli_mtime = CLI_PATH.stat().st_mtime_ns
+    if (
+        _cli_server is None
+        or _cli_server.poll() is not None
+        or _cli_server_mtime != cli_mtime
+    ):
+        stop_cli_server()
+        _cli_server = subprocess.Popen(
+            [str(CLI_PATH), "serve-dot"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        _cli_server_mtime = cli_mtime
+
+    return _cli_server
+
+
+def stop_cli_server(kill: bool = False) -> None:
+    """Stop the `typestates serve-dot` process, if running.
+
+    With kill=True the process is killed rather than asked to exit, for
+    a server that stopped following the protocol.
+    """
+    global _cli_server
+
+    if _cli_server is not None:
+        if kill:
+            _cli_server.kill()
+        # serve-dot exits at end of input; closing fails if it already died
+        with contextlib.suppress(BrokenPipeError):
+            _cli_server.stdin.close()
+        _cli_server.wait()
+        _cli_server = None
+
+
+atexit.register(stop_cli_server)
+
+
+def read_reply(server: subprocess.Popen) -> tuple[bytes, bytes, bytes]:
+    """Read one serve-dot reply, waiting at most CLI_TIMEOUT seconds for it.
+
+    Reads the pipe directly rather than through readline(), so a hung
+    process can't block the build.
+
+    Returns (tag, rest of the header, DOT text). Raises ValueError if the
+    process exits, stops answering or breaks the protocol.
+    """
+    deadline = time.monotonic() + CLI_TIMEOUT
+    fd = server.stdout.fileno()
+    reply = b""
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            header, newline, body = reply.partition(b"\n")
+            if newline:
+                fields = header.split(b"\t", 2)
+                if len(fields) != 3 or fields[0] not in (FRAME_START, FRAME_ERROR):
+                    raise ValueError(
+                        f"sent an unexpected reply: {header.decode(errors='replace')!r}"
+                    )
+                tag, _, rest = fields
+                if tag == FRAME_ERROR:
+                    return tag, rest, b""
+                if (b"\n" + body).endswith(b"\n" + FRAME_END):
+                    return tag, rest, body[:-len(FRAME_END)]
+
+            if not selector.select(deadline - time.monotonic()):
+                raise ValueError(f"did not reply within {CLI_TIMEOUT} seconds")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise ValueError("exited unexpectedly")
+            reply += chunk
+
+
+def request_dot(server: subprocess.Popen, snippet: Path) -> tuple[str, str]:
+    """Ask the serve-dot process for a snippet's DOT.
 
+    Replies are a tab-separated "===DOT===", source and name header line,
+    the DOT text, then an "===END===" line; or a single tab-separated
+    "===ERROR===", source and message line.
 
-def generate_diagram(nim_file: Path, output_dir: Path) -> bool:
-    """Generate SVG from a typestate snippet.
+    Returns (name, dot). Raises RuntimeError if the CLI reports an error.
+    If the process dies, hangs or breaks the protocol it is also stopped,
+    so the next cli_server() call starts a fresh one.
+    """
+    try:
+        server.stdin.write(f"{snippet}\n".encode())
+        server.stdin.flush()
+        tag, rest, dot = read_reply(server)
+    except (OSError, ValueError) as e:
+        stop_cli_server(kill=True)
+        raise RuntimeError(f"typestates serve-dot {e}") from e
+
+    if tag == FRAME_ERROR:
+        raise RuntimeError(rest.decode())
+
+    return rest.decode(), dot.decode()
+
+
+def generate_dots(
+    snippet_files: list[Path], output_dir: Path
+) -> Iterator[tuple[Path, Path, str]]:
+    """Generate DOT for each snippet through the shared typestates CLI process.
+
+    The DOT text is kept in memory for rendering; the .dot files are
+    written alongside only if they changed. Snippets the CLI can't
+    render are reported and skipped; if the CLI process dies, a new one
+    is started for the next snippet.
+
+    Yields (snippet, DOT file path, DOT text) as each snippet is answered.
+    """
+    for snippet in snippet_files:
+        try:
+            name, dot = request_dot(cli_server(), snippet)
+        except (RuntimeError, OSError) as e:
+            print(f"ERROR: typestates CLI failed on {snippet}: {e}")
+            continue
+
+        dot_file = output_dir / f"{name}.dot"
+        print(f"Processing {snippet.name} -> {name}...")
+        if write_if_changed(dot_file, dot):
+            print(f"  Created: {dot_file}")
+        yield snippet, dot_file, dot
 
-    Returns True on success, False on failure.
+
+def render_in_process(dots: list[str]) -> list[str] | None:
+    """Render DOT graphs to SVG through pygraphviz's bindings to libgvc.
+
+    Returns the SVG documents in order, or None on failure.
     """
-    name = extract_output_name(nim_file)
-    dot_file = output_dir / f"{name.lower()}.dot"
-    svg_file = output_dir / f"{name.lower()}.svg"
+    svgs = []
+    for dot in dots:
+        try:
+            graph = pygraphviz.AGraph(string=dot)
+            svgs.append(graph.draw(format="svg", prog="dot").decode())
+        except (ValueError, OSError) as e:
+            print(f"ERROR: Graphviz failed: {e}")
+            return None
 
-    print(f"Processing {nim_file.name} -> {name}...")
+    return svgs
 
-    # Run typestates CLI to generate DOT
-    result = subprocess.run(
-        ["./bin/typestates", "dot", str(nim_file)],
-        capture_output=True,
-        text=True
-    )
 
-    if result.returncode != 0:
-        print(f"  ERROR: typestates CLI failed: {result.stderr}")
-        return False
+def render_dot_batch(dots: list[str]) -> list[str]:
+    """Render DOT graphs to SVG with a single `dot` process.
 
-    # Write DOT file
-    dot_file.write_text(result.stdout)
-    print(f"  Created: {dot_file}")
+    All graphs are streamed through one `dot -Tsvg` over stdin, which
+    renders them in order as concatenated SVG documents on stdout.
 
-    # Convert to SVG using Graphviz
+    Returns the SVG documents in order. Raises RuntimeError on failure.
+    """
     try:
-        subprocess.run(
-            ["dot", "-Tsvg", str(dot_file), "-o", str(svg_file)],
+        result = subprocess.run(
+            ["dot", "-Tsvg"],
+            input="".join(dots),
             check=True,
             capture_output=True,
             text=True
         )
-        print(f"  Created: {svg_file}")
     except subprocess.CalledProcessError as e:
-        print(f"  ERROR: Graphviz failed: {e.stderr}")
-        return False
-    except FileNotFoundError:
-        print("  ERROR: 'dot' command not found. Install graphviz.")
-        return False
+        raise RuntimeError(f"Graphviz failed: {e.stderr}") from e
+    except FileNotFoundError as e:
+        raise RuntimeError("'dot' command not found. Install graphviz.") from e
 
-    return True
+    # Each rendered graph ends with its closing </svg> tag
+    svgs = [f"{svg}{SVG_END}" for svg in result.stdout.split(SVG_END)[:-1]]
+    if len(svgs) != len(dots):
+        raise RuntimeError(f"Graphviz rendered {len(svgs)} of {len(dots)} graphs")
+
+    return svgs
+
+
+def render_with_dot(dots: Iterable[str], total: int) -> list[str] | None:
+    """Render DOT graphs to SVG with parallel `dot` processes.
+
+    Graphs are grouped into contiguous batches, one per CPU for `total`
+    graphs. Each batch goes to its own `dot` process as soon as it fills,
+    so rendering overlaps with producing the remaining graphs.
+
+    Returns the SVG documents in order, or None on failure.
+    """
+    workers = min(total, os.cpu_count() or 1)
+    batch_size = -(-total // workers)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            batch = []
+            for dot in dots:
+                batch.append(dot)
+                if len(batch) == batch_size:
+                    futures.append(executor.submit(render_dot_batch, batch))
+                    batch = []
+            if batch:
+                futures.append(executor.submit(render_dot_batch, batch))
+
+            return [svg for future in futures for svg in future.result()]
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return None
+
+
+def generate_diagrams(
+    dots: Iterator[tuple[Path, Path, str]], total: int
+) -> dict[Path, list[Path]] | None:
+    """Render DOT graphs to SVG files alongside their DOT files.
+
+    Renders in-process when pygraphviz is installed, otherwise through
+    the `dot` command, starting as the graphs arrive. `total` is the
+    number of graphs expected, used to size the `dot` batches.
+
+    Returns the DOT and SVG files of each snippet rendered, or None on failure.
+    """
+    snippets = []
+    dot_files = []
+
+    def graphs() -> Iterator[str]:
+        for snippet, dot_file, dot in dots:
+            snippets.append(snippet)
+            dot_files.append(dot_file)
+            yield dot
+
+    if pygraphviz is not None:
+        svgs = render_in_process(list(graphs()))
+    else:
+        svgs = render_with_dot(graphs(), total)
+
+    if svgs is None:
+        return None
+
+    outputs = {}
+    for snippet, dot_file, svg in zip(snippets, dot_files, svgs):
+        svg_file = dot_file.with_suffix(".svg")
+        outputs[snippet] = [dot_file, svg_file]
+        if write_if_changed(svg_file, svg):
+            print(f"  Created: {svg_file}")
+        else:
+            print(f"  Unchanged: {svg_file}")
+
+    return outputs
 
 
-def main() -> int:
-    """Main entry point. Returns 0 on success, 1 on failure."""
+def main(snippet_files: list[Path] | None = None) -> int:
+    """Main entry point. Returns 0 on success, 1 on failure.
+
+    Generates diagrams for the given snippets, or for every snippet in
+    SNIPPETS_DIR when none are given.
+    """
 
     # Check for snippets directory
     if not SNIPPETS_DIR.exists():
@@ -108,28 +372,33 @@ def main() -> int:
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
     # Check for CLI
-    cli_path = Path("./bin/typestates")
-    if not cli_path.exists():
+    if not CLI_PATH.exists():
         print("ERROR: typestates CLI not found. Run 'nimble build' first.")
         return 1
 
-    # Process all snippet files
-    snippet_files = list(SNIPPETS_DIR.glob("*_typestate.nim"))
+    # Process the requested snippet files, defaulting to all of them
+    if not snippet_files:
+        snippet_files = list(SNIPPETS_DIR.glob("*_typestate.nim"))
     if not snippet_files:
         print(f"WARNING: No *_typestate.nim files found in {SNIPPETS_DIR}")
         return 0
 
-    success_count = 0
-    for nim_file in sorted(snippet_files):
-        if generate_diagram(nim_file, OUTPUT_DIR):
-            success_count += 1
+    # Hash the sources before generating, so edits made meanwhile stay stale
+    hashes = {path: file_hash(path) for path in [CLI_PATH, *snippet_files]
+              if path.is_file()}
+
+    dots = generate_dots(sorted(snippet_files), OUTPUT_DIR)
+    rendered = generate_diagrams(dots, len(snippet_files))
+    if rendered is None:
+        return 1
 
-    print(f"\nGenerated {success_count}/{len(snippet_files)} diagrams")
+    record_hashes(hashes, rendered)
+    print(f"\nGenerated {len(rendered)}/{len(snippet_files)} diagrams")
 
-    if success_count < len(snippet_files):
+    if len(rendered) < len(snippet_files):
         return 1
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(main([Path(arg) for arg in sys.argv[1:]]))
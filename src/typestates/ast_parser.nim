@@ -10,7 +10,10 @@ import std/[os, strutils, options]
 # Compiler imports - requires Nim compiler source
 import
   compiler/
-    [ast, parser, llstream, idents, options as compiler_options, pathutils, renderer]
+    [
+      ast, parser, llstream, idents, lineinfos, options as compiler_options, pathutils,
+      renderer,
+    ]
 
 type
   ParsedBridge* = object ## A bridge parsed from source code.
@@ -439,6 +442,17 @@ proc parseFileWithAst*(path: string): ParseResult =
   config.notes = {}
   config.foreignPackageNotes = {}
 
+  # Record syntax errors instead of letting the compiler quit the process
+  # on the first one, so long-running callers (serve-dot) survive them.
+  # Locations use the compiler's `file(line, col)` format, with 1-based columns.
+  var firstError = ""
+  config.errorMax = high(int)
+  config.structuredErrorHook = proc(
+      conf: ConfigRef, info: TLineInfo, msg: string, severity: Severity
+  ) {.closure, gcsafe.} =
+    if severity == Severity.Error and firstError.len == 0:
+      firstError = path & "(" & $info.line & ", " & $(info.col + 1) & "): " & msg
+
   var p: Parser
   let stream = llStreamOpen(content)
   if stream == nil:
@@ -450,10 +464,14 @@ proc parseFileWithAst*(path: string): ParseResult =
     closeParser(p)
 
     # Walk AST looking for typestates
-    walkAst(ast, result.typestates)
+    if config.errorCounter == 0:
+      walkAst(ast, result.typestates)
   except Exception as e:
     raise newParseError("Parse error in " & path & ": " & e.msg)
 
+  if config.errorCounter > 0:
+    raise newParseError("Parse error in " & firstError)
+
 proc parseTypestatesAst*(paths: seq[string]): ParseResult =
   ## Parse all Nim files in the given paths for typestates.
   ##
@@ -380,6 +380,21 @@ proc generateSeparateDot*(
   lines.add "}"
   result = lines.join("\n")
 
+proc dotOutputName*(path: string, typestates: seq[ParsedTypestate]): string =
+  ## Compute the output file name (without extension) for a source file.
+  ##
+  ## Files defining a single typestate are named after that typestate.
+  ## Files defining several typestates (or none) fall back to the file
+  ## name with any `_typestate` suffix removed.
+  ##
+  ## :param path: Path to the Nim source file
+  ## :param typestates: Typestates parsed from that file
+  ## :returns: Lowercase base name, e.g. `payment` or `multi`
+  if typestates.len == 1:
+    result = typestates[0].name.toLowerAscii()
+  else:
+    result = path.splitFile.name.replace("_typestate", "").toLowerAscii()
+
 proc branchEnumPrefix(typeName: string): string =
   ## Generate a short prefix for branch enum fields.
   if typeName.len > 0:
@@ -4,6 +4,26 @@
 import std/[os, strutils]
 import typestates/cli
 
+proc renderDot(
+    typestates: seq[ParsedTypestate],
+    separate: bool,
+    noStyle: bool,
+    splineMode: SplineMode,
+): string =
+  ## Render typestates as DOT, either unified or one graph per typestate.
+  if separate:
+    for ts in typestates:
+      result.add generateSeparateDot(ts, noStyle, splineMode) & "\n\n"
+  else:
+    result = generateUnifiedDot(typestates, noStyle, splineMode) & "\n"
+
+proc frameDot(source, name, dot: string): string =
+  ## Wrap a source file's DOT output in a frame for `serve-dot` replies.
+  ##
+  ## Frames start with a tab-separated `===DOT===`, source path and output
+  ## name header line, and end with an `===END===` line.
+  result = "===DOT===\t" & source & "\t" & name & "\n" & dot & "===END===\n"
+
 proc showHelp() =
   echo "typestates - Compile-time typestate validation for Nim"
   echo ""
@@ -12,6 +32,8 @@ proc showHelp() =
   echo "  typestates dot [paths...]      Generate unified GraphViz DOT output"
   echo "  typestates dot --separate [paths...]  Generate separate DOT per typestate"
   echo "  typestates codegen [paths...]  Generate helper code (enum, union, procs)"
+  echo "  typestates serve-dot           Read source paths from stdin, one per line,"
+  echo "                                 and write a framed DOT graph for each"
   echo ""
   echo "Options:"
   echo "  -h, --help              Show this help"
@@ -45,6 +67,13 @@ proc showHelp() =
   echo "  Use --no-style for minimal DOT output that's easier to customize with"
   echo "  your own colors, fonts, and styling."
   echo ""
+  echo "  The 'serve-dot' command keeps running so tools can render many files"
+  echo "  without restarting the CLI. It answers each path with its graph between"
+  echo "  a tab-separated '===DOT=== <source> <name>' line and an '===END===' line,"
+  echo "  or with a tab-separated '===ERROR=== <source> <message>' line. Files with"
+  echo "  a single typestate are named after it; files with several use the file"
+  echo "  name minus any '_typestate' suffix. It exits at end of input."
+  echo ""
   echo "  The 'codegen' command outputs the Nim code that the typestate macro"
   echo "  generates: state enum, union type, state procs, and branch types."
 
@@ -137,19 +166,35 @@ when isMainModule:
         echo "No typestates found in ", pathArgs.join(", ")
         quit(1)
 
-      if separateFlag:
-        # Generate separate graph for each typestate
-        for ts in parseResult.typestates:
-          echo generateSeparateDot(ts, noStyleFlag, splineMode)
-          echo ""
-      else:
-        # Generate unified graph
-        echo generateUnifiedDot(parseResult.typestates, noStyleFlag, splineMode)
+      stdout.write renderDot(
+        parseResult.typestates, separateFlag, noStyleFlag, splineMode
+      )
 
       quit(0)
     except ParseError as e:
       echo "ERROR: ", e.msg
       quit(1)
+  of "serve-dot":
+    # Answer each path on stdin with one frame, flushing so callers can
+    # read the reply before sending the next path
+    var line: string
+    while stdin.readLine(line):
+      let source = line.strip()
+      if source.len == 0:
+        continue
+      try:
+        let fileResult = parseTypestates(@[source])
+        if fileResult.typestates.len == 0:
+          stdout.write "===ERROR===\t" & source & "\tNo typestates found in " & source &
+            "\n"
+        else:
+          let name = dotOutputName(source, fileResult.typestates)
+          let dot = renderDot(fileResult.typestates, false, false, smSpline)
+          stdout.write frameDot(source, name, dot)
+      except ParseError as e:
+        stdout.write "===ERROR===\t" & source & "\t" & e.msg.replace("\n", " ") & "\n"
+      stdout.flushFile()
+    quit(0)
   of "codegen":
     try:
       var pathArgs: seq[string] = @[]
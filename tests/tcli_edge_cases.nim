@@ -19,6 +19,13 @@ block syntaxErrorTest:
     echo output
     quit(1)
 
+  # Check that the error points at the offending line and column
+  if "tests/fixtures/syntax_error.nim(" notin output:
+    echo "FAIL: Expected the syntax error location in the message"
+    echo "Output:"
+    echo output
+    quit(1)
+
   echo "PASS: Syntax errors cause verification to fail with clear message"
 
 # Test parsing multiple files works correctly
@@ -65,4 +72,59 @@ block dotOutputTest:
 
   echo "PASS: DOT output is valid"
 
+# Test that serve-dot answers each path on stdin with a frame or an error
+block serveDotTest:
+  let (output, exitCode) = execCmdEx(
+    "nim c -r --hints:off --path:src src/typestates_bin.nim serve-dot 2>&1",
+    input = "tests/fixtures/basic_typestate.nim\ntests/fixtures/missing.nim\n",
+  )
+
+  if exitCode != 0:
+    echo "FAIL: serve-dot did not exit cleanly at end of input"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  if "===DOT===\ttests/fixtures/basic_typestate.nim\tfile\n" notin output or
+      "===END===\n" notin output:
+    echo "FAIL: Expected a DOT frame for basic_typestate.nim"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  if "===ERROR===\ttests/fixtures/missing.nim\t" notin output:
+    echo "FAIL: Expected an error line for missing.nim"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  echo "PASS: serve-dot answers each path with a frame or an error"
+
+# Test that serve-dot survives a syntax error and keeps answering
+block serveDotSyntaxErrorTest:
+  let (output, exitCode) = execCmdEx(
+    "nim c -r --hints:off --path:src src/typestates_bin.nim serve-dot 2>&1",
+    input = "tests/fixtures/syntax_error.nim\ntests/fixtures/basic_typestate.nim\n",
+  )
+
+  if exitCode != 0:
+    echo "FAIL: serve-dot exited on a syntax error"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  if "===ERROR===\ttests/fixtures/syntax_error.nim\t" notin output:
+    echo "FAIL: Expected an error line for syntax_error.nim"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  if "===DOT===\ttests/fixtures/basic_typestate.nim\tfile\n" notin output:
+    echo "FAIL: Expected a DOT frame for basic_typestate.nim after the syntax error"
+    echo "Output:"
+    echo output
+    quit(1)
+
+  echo "PASS: serve-dot keeps answering after a syntax error"
+
 echo "All CLI edge case tests passed!"